@@ -7,6 +7,49 @@ from typing import Any, Dict, List
 from .const import DOMAIN
 
 
+def _split_hours(hours_str: str) -> list[int]:
+    """Split a comma-separated string of hours into integers."""
+    try:
+        return [int(hour) for hour in hours_str.split(",")]
+    except ValueError as err:
+        raise vol.Invalid("Invalid format. Use comma-separated hours.") from err
+
+
+_LITER_COST_CONSTRAINT = vol.All(
+    vol.Coerce(float, msg="Not a valid number"),
+    vol.Range(min=0.00005, max=1.0, msg="Value must be between 0.00005 and 1.0"),
+)
+_FETCH_HOURS_CONSTRAINT = vol.All(
+    _split_hours, [vol.Range(min=0, max=23, msg="Hours must be between 0 and 23")]
+)
+
+
+def _build_data_schema(defaults: Dict[str, Any]) -> vol.Schema:
+    """Build the data schema with the given defaults."""
+    return vol.Schema(
+        {
+            vol.Required(
+                "username", default=defaults.get("username", "email@email.com")
+            ): str,
+            vol.Required("password", default=defaults.get("password", "")): str,
+            vol.Required(
+                "account_number", default=defaults.get("account_number", "")
+            ): str,
+            vol.Required("meter_id", default=defaults.get("meter_id", "")): str,
+            vol.Required(
+                "liter_cost", default=defaults.get("liter_cost", "0.0030682")
+            ): str,
+            vol.Optional(
+                "fetch_hours", default=defaults.get("fetch_hours", "15,23")
+            ): str,
+        }
+    )
+
+
+# The user step has no defaults, so its schema is compiled once at import.
+_USER_SCHEMA = _build_data_schema({})
+
+
 class ThamesWaterConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Handle a config flow for Thames Water."""
 
@@ -53,44 +96,21 @@ class ThamesWaterConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     def _validate_input(self, user_input: Dict[str, Any]) -> Dict[str, str]:
         """Validate user input."""
         errors = {}
-        liter_cost_str = user_input.get("liter_cost")
         try:
-            liter_cost_val = float(liter_cost_str)
-            if liter_cost_val < 0.00005 or liter_cost_val > 1.0:
-                errors["liter_cost"] = "Value must be between 0.00005 and 1.0"
-        except (TypeError, ValueError):
-            errors["liter_cost"] = "Not a valid number"
+            _LITER_COST_CONSTRAINT(user_input.get("liter_cost"))
+        except vol.Invalid as err:
+            errors["liter_cost"] = err.msg
 
-        hours_str = user_input.get("fetch_hours", "")
         try:
-            hours = [int(hour) for hour in hours_str.split(",")]
-            if any(hour < 0 or hour > 23 for hour in hours):
-                errors["fetch_hours"] = "Hours must be between 0 and 23"
-        except ValueError:
-            errors["fetch_hours"] = "Invalid format. Use comma-separated hours."
+            _FETCH_HOURS_CONSTRAINT(user_input.get("fetch_hours", ""))
+        except vol.Invalid as err:
+            errors["fetch_hours"] = err.msg
 
         return errors
 
     def _get_data_schema(self, defaults: Dict[str, Any] = None) -> vol.Schema:
         """Return the data schema with optional defaults."""
         if defaults is None:
-            defaults = {}
-
-        return vol.Schema(
-            {
-                vol.Required(
-                    "username", default=defaults.get("username", "email@email.com")
-                ): str,
-                vol.Required("password", default=defaults.get("password", "")): str,
-                vol.Required(
-                    "account_number", default=defaults.get("account_number", "")
-                ): str,
-                vol.Required("meter_id", default=defaults.get("meter_id", "")): str,
-                vol.Required(
-                    "liter_cost", default=defaults.get("liter_cost", "0.0030682")
-                ): str,
-                vol.Optional(
-                    "fetch_hours", default=defaults.get("fetch_hours", "15,23")
-                ): str,
-            }
-        )
+            return _USER_SCHEMA
+
+        return _build_data_schema(defaults)
@@ -54,10 +54,11 @@ class ThamesWaterLiterCost(ThamesWaterEntity, NumberEntity):
 
     async def async_set_native_value(self, value: float) -> None:
         """Handle user changes by updating both local value and config options."""
+        if value == self._value:
+            return
         self._value = value
-        new_options = dict(self._config_entry.options)
-        new_options["liter_cost"] = value
         self.hass.config_entries.async_update_entry(
-            self._config_entry, options=new_options
+            self._config_entry,
+            options={**self._config_entry.options, "liter_cost": value},
         )
         self.async_write_ha_state()
@@ -2,11 +2,14 @@
 
 from __future__ import annotations
 
-from datetime import datetime, timedelta
+import asyncio
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
 import logging
 import async_timeout
-from operator import itemgetter
+from operator import attrgetter
 import random
+from typing import NamedTuple
 
 from homeassistant.components.recorder import get_instance
 from homeassistant.components.recorder.models import StatisticData, StatisticMetaData
@@ -27,10 +30,23 @@ from homeassistant.util import dt as dt_util
 
 from .const import DOMAIN
 from .entity import ThamesWaterEntity
-from .thameswaterclient import ThamesWater
+from .thameswaterclient import Line, MeterUsage, SessionExpiredError, ThamesWater
 
 _LOGGER = logging.getLogger(__name__)
 UPDATE_HOURS = [15,23]
+# Number of days of complete hourly data kept between updates.
+DAY_CACHE_DAYS = 10
+HOURS_PER_DAY = 24
+# Maximum number of days fetched from Thames Water at the same time.
+FETCH_CONCURRENCY = 4
+
+
+class Reading(NamedTuple):
+    """Hourly water usage reading."""
+
+    dt: datetime  # Start of the hour, in local time
+    state: float  # Usage in Liters per hour
+
 
 async def async_setup_entry(
     hass: HomeAssistant, entry: ConfigEntry, async_add_entities
@@ -61,30 +77,32 @@ async def async_setup_entry(
 
 
 def _generate_statistics_from_readings(
-    readings: list[tuple[datetime, float]],
+    readings: list[Reading],
     cumulative_start: float = 0.0,
-    liter_cost: float = None,
-) -> list[StatisticData]:
-    """Convert a list of (datetime, reading) entries into StatisticData entries."""
-    sorted_readings = sorted(readings, key=lambda x: x["dt"])
+    cost_cumulative_start: float = 0.0,
+    liter_cost: float = 0.0,
+    assume_sorted: bool = False,
+) -> tuple[list[StatisticData], list[StatisticData]]:
+    """Convert a list of readings into consumption and cost StatisticData entries.
+
+    Pass assume_sorted=True when readings are already in chronological order.
+    """
+    if assume_sorted:
+        sorted_readings = readings
+    else:
+        sorted_readings = sorted(readings, key=attrgetter("dt"))
     cumulative = cumulative_start
+    cost_cumulative = cost_cumulative_start
     stats: list[StatisticData] = []
+    cost_stats: list[StatisticData] = []
     for elem in sorted_readings:
-        # Normalize the start timestamp to the hour
-        hour_ts = elem["dt"].replace(minute=0, second=0, microsecond=0)
-        if liter_cost is None:
-            value = elem["state"]
-        else:
-            value = elem["state"] * liter_cost
-        cumulative += value
-        stats.append(
-            StatisticData(
-                start=dt_util.as_utc(hour_ts),
-                state=value,
-                sum=cumulative,
-            )
-        )
-    return stats
+        hour_ts = dt_util.as_utc(elem.dt)
+        cost = elem.state * liter_cost
+        cumulative += elem.state
+        cost_cumulative += cost
+        stats.append(StatisticData(start=hour_ts, state=elem.state, sum=cumulative))
+        cost_stats.append(StatisticData(start=hour_ts, state=cost, sum=cost_cumulative))
+    return stats, cost_stats
 
 
 class ThamesWaterSensor(ThamesWaterEntity, SensorEntity):
@@ -109,7 +127,10 @@ class ThamesWaterSensor(ThamesWaterEntity, SensorEntity):
         self._password = config_entry.data["password"]
         self._account_number = config_entry.data["account_number"]
         self._meter_id = config_entry.data["meter_id"]
-        self._cookies_dict = None
+        # Client kept across updates so its logged-in session is reused.
+        self._tw_client: ThamesWater | None = None
+        # Lines of days whose hourly data was complete, keyed by day.
+        self._day_cache: dict[date, list[Line]] = {}
 
         self._attr_unique_id = f"water_usage_{self._meter_id}"
         self._attr_should_poll = False
@@ -119,34 +140,70 @@ class ThamesWaterSensor(ThamesWaterEntity, SensorEntity):
         """Return the sensor state (latest hourly consumption in Liters)."""
         return self._state
 
+    async def async_will_remove_from_hass(self) -> None:
+        """Close the Thames Water client session."""
+        if self._tw_client is not None:
+            await self._hass.async_add_executor_job(self._tw_client.close)
+            self._tw_client = None
+
     @callback
     async def async_update_callback(self, ts) -> None:
         """Update the sensor state."""
         await self.async_update()
         self.async_write_ha_state()
 
+    async def _fetch_day(
+        self, tw_client: ThamesWater, day: date, semaphore: asyncio.Semaphore
+    ) -> MeterUsage | None:
+        """Fetch the hourly usage for a single day."""
+        d = datetime(day.year, day.month, day.day)
+        try:
+            async with semaphore:
+                _LOGGER.debug(
+                    "Fetching data for %s/%s/%s", day.day, day.month, day.year
+                )
+                return await self._hass.async_add_executor_job(
+                    tw_client.get_meter_usage,
+                    self._meter_id,
+                    d,
+                    d,
+                )
+        except SessionExpiredError:
+            # Let async_update see this, so it can drop the session.
+            raise
+        except Exception:  # If data is not yet available, it will raise an exception.
+            _LOGGER.warning(
+                "Could not get data for %s/%s/%s", day.day, day.month, day.year
+            )
+            return None
+
     async def async_update(self):
         """Fetch data, build hourly statistics, and inject external statistics."""
         consumption_stat_id = f"{DOMAIN}:thameswater_consumption"
         cost_stat_id = f"{DOMAIN}:thameswater_cost"
 
         try:
+            recorder = get_instance(self.hass)
             async with async_timeout.timeout(5):  # seconds
-                last_stats = await get_instance(self.hass).async_add_executor_job(
-                    get_last_statistics, self.hass, 1, consumption_stat_id, True, {"sum"}
-                )
-            async with async_timeout.timeout(5):
-                last_cost_stats = await get_instance(self.hass).async_add_executor_job(
-                    get_last_statistics, self.hass, 1, cost_stat_id, True, {"sum"}
+                last_stats, last_cost_stats = await asyncio.gather(
+                    recorder.async_add_executor_job(
+                        get_last_statistics,
+                        self.hass,
+                        1,
+                        consumption_stat_id,
+                        True,
+                        {"sum"},
+                    ),
+                    recorder.async_add_executor_job(
+                        get_last_statistics, self.hass, 1, cost_stat_id, True, {"sum"}
+                    ),
                 )
             # If a previous value exists, use its "sum" as the starting cumulative.
             if len(last_stats.get(consumption_stat_id, [])) > 0:
-                last_stats = last_stats[consumption_stat_id]
-                last_stats = sorted(last_stats, key=itemgetter("start"), reverse=False)[0]
+                last_stats = last_stats[consumption_stat_id][0]
             # If a previous value exists, use its "sum" as the starting cumulative.
             if len(last_cost_stats.get(cost_stat_id, [])) > 0:
-                last_cost_stats = last_cost_stats[cost_stat_id]
-                last_cost_stats = sorted(last_cost_stats, key=itemgetter("start"), reverse=False)[0]
+                last_cost_stats = last_cost_stats[cost_stat_id][0]
 
         except AttributeError:
             last_stats = None
@@ -158,80 +215,104 @@ class ThamesWaterSensor(ThamesWaterEntity, SensorEntity):
         # Data is available from at least 3 days ago.
         end_dt = datetime.now() - timedelta(days=3)
         if last_stats is not None and last_stats.get("sum") is not None:
-            start_dt = dt_util.as_utc(datetime.fromtimestamp(last_stats.get("start")))
+            last_start_ts = dt_util.utc_from_timestamp(last_stats["start"])
+            start_dt = last_start_ts
         else:
             start_dt = end_dt - timedelta(days=30)
 
         current_date = start_dt.date()
         end_date = end_dt.date()
 
-        try:
-            _LOGGER.debug("Creating Thames Water Client")
-            tw_client = await self._hass.async_add_executor_job(
-                ThamesWater,
-                self._username,
-                self._password,
-                self._account_number,
-            )
-        except Exception as err:
-            _LOGGER.error("Error creating Thames Water client: %s", err)
-            return
-
-        # readings holds all hourly data for the entire period.
-        readings: list[dict] = []
-        latest_usage = 0
+        days: list[date] = []
         while current_date <= end_date:
-            year = current_date.year
-            month = current_date.month
-            day = current_date.day
+            days.append(current_date)
             current_date = current_date + timedelta(days=1)
 
-            d = datetime(year, month, day)
-            _LOGGER.debug("Fetching data for %s/%s/%s", day, month, year)
+        # Complete days don't change, so only fetch days missing from the cache.
+        cache_start = end_date - timedelta(days=DAY_CACHE_DAYS)
+        for cached_day in [d for d in self._day_cache if d < cache_start]:
+            del self._day_cache[cached_day]
+        day_lines: dict[date, list[Line]] = {
+            day: self._day_cache[day] for day in days if day in self._day_cache
+        }
+        days_to_fetch = [day for day in days if day not in day_lines]
+
+        if days_to_fetch:
+            if self._tw_client is None:
+                _LOGGER.debug("Creating Thames Water Client")
+                self._tw_client = ThamesWater(
+                    self._username,
+                    self._password,
+                    self._account_number,
+                )
+            tw_client = self._tw_client
             try:
-                data = await self._hass.async_add_executor_job(
-                    tw_client.get_meter_usage,
-                    self._meter_id,
-                    d,
-                    d,
+                await self._hass.async_add_executor_job(
+                    tw_client.ensure_authenticated
                 )
-            except (
-                Exception
-            ):  # If data is not yet available, it will raise an exception.
-                data = None
-                _LOGGER.warning("Could not get data for %s/%s/%s", day, month, year)
-
-            if (
-                data is None
-                or data.Lines is None
-                or data.IsDataAvailable is False
-                or data.IsError
-            ):
+            except Exception as err:
+                _LOGGER.error("Error authenticating with Thames Water: %s", err)
+                return
+
+            # Days are independent of each other, so fetch them concurrently
+            # over the client's already authenticated session.
+            semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+            results = await asyncio.gather(
+                *(
+                    self._fetch_day(tw_client, day, semaphore)
+                    for day in days_to_fetch
+                ),
+                return_exceptions=True,
+            )
+            if any(isinstance(data, SessionExpiredError) for data in results):
+                # The session is no longer usable, so log in afresh next update.
+                _LOGGER.warning("Thames Water session expired, dropping client")
+                self._tw_client = None
+                await self._hass.async_add_executor_job(tw_client.close)
+            for fetched_day, data in zip(days_to_fetch, results):
+                if (
+                    not isinstance(data, MeterUsage)
+                    or data.Lines is None
+                    or data.IsDataAvailable is False
+                    or data.IsError
+                ):
+                    continue
+                day_lines[fetched_day] = data.Lines
+                if len(data.Lines) >= HOURS_PER_DAY and fetched_day >= cache_start:
+                    self._day_cache[fetched_day] = data.Lines
+
+        # readings holds all hourly data for the entire period.
+        readings: list[Reading] = []
+        latest_usage = 0
+        local_tz = dt_util.DEFAULT_TIME_ZONE
+        for fetched_day in days:
+            lines = day_lines.get(fetched_day)
+            if lines is None:
                 continue
 
+            year = fetched_day.year
+            month = fetched_day.month
+            day = fetched_day.day
+
             # Process the returned data; expect a "Lines" list.
-            lines = data.Lines
             latest_usage = 0
             for line in lines:
                 time_str = line.Label
                 usage = line.Usage
                 latest_usage += usage
+                # Labels are "HH:MM" and readings are hourly, so only the hour
+                # is needed.
                 try:
-                    hour, minute = map(int, time_str.split(":"))
-                except Exception as err:
+                    hour = int(time_str.partition(":")[0])
+                except ValueError as err:
                     _LOGGER.error("Error parsing time %s: %s", time_str, err)
                     continue
-                naive_datetime = datetime(year, month, day, hour, minute)
-                readings.append(
-                    {
-                        "dt": naive_datetime,
-                        "state": usage,  # Usage in Liters per hour
-                    }
-                )
+                # Readings are in local time, attach the zone once here.
+                local_datetime = datetime(year, month, day, hour, tzinfo=local_tz)
+                readings.append(Reading(local_datetime, usage))
 
         _LOGGER.info("Fetched %d historical entries", len(readings))
-        # Clear temporary cookies.
-        self._cookies_dict = None
+        readings.sort(key=attrgetter("dt"))
 
         liter_cost = self._config_entry.options.get(
             "liter_cost", self._config_entry.data.get("liter_cost")
@@ -247,8 +328,9 @@ class ThamesWaterSensor(ThamesWaterEntity, SensorEntity):
         if last_stats is not None and last_stats.get("sum") is not None:
             initial_cumulative = last_stats["sum"]
             # Discard all readings before last_stats["start"].
-            start_ts = dt_util.as_utc(datetime.fromtimestamp(last_stats.get("start")))
-            readings = [r for r in readings if dt_util.as_utc(r["dt"]) > start_ts]
+            readings = readings[
+                bisect_right(readings, last_start_ts, key=attrgetter("dt")) :
+            ]
         else:
             initial_cumulative = 0.0
 
@@ -262,13 +344,12 @@ class ThamesWaterSensor(ThamesWaterEntity, SensorEntity):
             return
 
         # Generate new StatisticData entries using the previous cumulative sum.
-        stats = _generate_statistics_from_readings(
-            readings, cumulative_start=initial_cumulative
-        )
-        cost_stats = _generate_statistics_from_readings(
+        stats, cost_stats = _generate_statistics_from_readings(
             readings,
-            cumulative_start=initial_cost_cumulative,
+            cumulative_start=initial_cumulative,
+            cost_cumulative_start=initial_cost_cumulative,
             liter_cost=float(liter_cost),
+            assume_sorted=True,
         )
         if latest_usage > 0:
             self._state = latest_usage
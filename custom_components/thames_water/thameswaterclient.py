@@ -3,17 +3,87 @@ from dataclasses import dataclass, field
 import datetime
 import hashlib
 import logging
+from operator import itemgetter
 import os
+import re
+import secrets
+import threading
 from typing import Literal, Optional
-import uuid
+from urllib.parse import parse_qs, urlparse
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Home Assistant logger namespace
 logger = logging.getLogger("homeassistant.components.thames_water")
 
-
-@dataclass
+# Seconds to wait for Thames Water to respond before giving up on a request.
+REQUEST_TIMEOUT = 30
+# Transient server errors are retried on the same session, with backoff.
+RETRY = Retry(
+    total=3,
+    backoff_factor=0.3,
+    status_forcelist=(429, 500, 502, 503, 504),
+    raise_on_status=False,
+)
+# Line fields in the order of the Line dataclass.
+LINE_FIELDS = itemgetter("Label", "Usage", "Read", "IsEstimated", "MeterSerialNumberHis")
+# Hidden id_token input on the myaccount SignIn page.
+ID_TOKEN_RE = re.compile(rb"id='id_token' value='([^']*)'")
+
+LOGIN_BASE_URL = "https://login.thameswater.co.uk/identity.thameswater.co.uk"
+LOGIN_DOMAIN = urlparse(LOGIN_BASE_URL).netloc
+AUTHORIZE_URL = f"{LOGIN_BASE_URL}/b2c_1_tw_website_signin/oauth2/v2.0/authorize"
+SELF_ASSERTED_URL = f"{LOGIN_BASE_URL}/B2C_1_tw_website_signin/SelfAsserted"
+CONFIRMED_URL = f"{LOGIN_BASE_URL}/B2C_1_tw_website_signin/api/CombinedSigninAndSignup/confirmed"
+TOKEN_URL = f"{LOGIN_BASE_URL}/b2c_1_tw_website_signin/oauth2/v2.0/token"
+REDIRECT_URI = "https://www.thameswater.co.uk/login"
+MYACCOUNT_BASE_URL = "https://myaccount.thameswater.co.uk"
+LOGIN_URL = f"{MYACCOUNT_BASE_URL}/login"
+DASHBOARD_URL = f"{MYACCOUNT_BASE_URL}/mydashboard"
+METERS_USAGE_URL = f"{MYACCOUNT_BASE_URL}/mydashboard/my-meters-usage"
+SIGNIN_URL = f"{MYACCOUNT_BASE_URL}/twservice/Account/SignIn?useremail="
+USAGE_URL = f"{MYACCOUNT_BASE_URL}/ajax/waterMeter/getSmartWaterMeterConsumptions"
+USAGE_NETLOC = urlparse(USAGE_URL).netloc
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36"
+FORM_HEADERS = {"content-type": "application/x-www-form-urlencoded;charset=utf-8"}
+LOGIN_HEADERS = {"content-type": "application/x-www-form-urlencoded"}
+MYACCOUNT_HEADERS = {
+    "Referer": SIGNIN_URL,
+}
+USAGE_HEADERS = {
+    "Referer": METERS_USAGE_URL,
+    "X-Requested-With": "XMLHttpRequest",
+}
+
+# Constant fields of the OAuth token requests, as sent by the website.
+AUTHORIZATION_CODE_DATA = {
+    "redirect_uri": REDIRECT_URI,
+    "scope": "openid offline_access profile",
+    "grant_type": "authorization_code",
+    "client_info": "1",
+    "x-client-SKU": "msal.js.browser",
+    "x-client-VER": "3.1.0",
+    "x-ms-lib-capability": "retry-after, h429",
+    "x-client-current-telemetry": "5|865,0,,,|,",
+    "x-client-last-telemetry": "5|0|||0,0",
+}
+REFRESH_TOKEN_DATA = {
+    "scope": "openid profile offline_access",
+    "grant_type": "refresh_token",
+    "client_info": "1",
+    "x-client-SKU": "msal.js.browser",
+    "x-client-VER": "3.1.0",
+    "x-ms-lib-capability": "retry-after, h429",
+    "x-client-current-telemetry": "5|61,0,,,|@azure/msal-react,2.0.3",
+    "x-client-last-telemetry": "5|0|||0,0",
+}
+
+
+@dataclass(slots=True)
 class Line:
     Label: str
     Usage: float
@@ -22,7 +92,7 @@ class Line:
     MeterSerialNumberHis: str
 
 
-@dataclass
+@dataclass(slots=True)
 class MeterUsage:
     IsError: bool
     IsDataAvailable: bool
@@ -42,13 +112,17 @@ class MeterUsage:
     )  # assumption that it could be a dict
 
 
-@dataclass
+@dataclass(slots=True)
 class Measurement:
-    hour_start: datetime
+    hour_start: datetime.datetime
     usage: int  # Usage
     total: int  # Read
 
 
+class SessionExpiredError(requests.HTTPError):
+    """The usage endpoint did not accept the logged in session."""
+
+
 class ThamesWater:
     def __init__(
         self,
@@ -58,51 +132,90 @@ class ThamesWater:
         client_id: str = "cedfde2d-79a7-44fd-9833-cae769640d3d",
     ):
         self.s = requests.session()
+        self.s.mount("https://", HTTPAdapter(max_retries=RETRY))
+        self.s.headers["user-agent"] = USER_AGENT
         self.account_number = account_number
+        self._dashboard_url = (
+            f"{METERS_USAGE_URL}?contractAccountNumber={account_number}"
+        )
         self.client_id = client_id
         self.logger = logger.getChild(self.__class__.__name__)
-        self._authenticate(email, password)
+        self._email = email
+        self._password = password
+        # Serialises logins between concurrent usage fetches. The generation
+        # counts completed logins, 0 means not logged in yet.
+        self._auth_lock = threading.Lock()
+        self._auth_generation = 0
+
+    def close(self):
+        self.s.close()
+
+    def ensure_authenticated(self):
+        if self._auth_generation == 0:
+            self._authenticate_once(0)
+
+    def _authenticate_once(self, generation: int):
+        with self._auth_lock:
+            # Another thread may already have logged in while we waited.
+            if self._auth_generation != generation:
+                return
+            # Start every login from an empty jar, as the first one does, so
+            # stale B2C and myaccount cookies can't short-circuit the flow.
+            self.s.cookies.clear()
+            self._authenticate(self._email, self._password)
+            self._auth_generation += 1
+
+    def _session_rejected(self, r: requests.Response) -> bool:
+        return r.status_code in (401, 403) or bool(
+            r.history and urlparse(r.url).netloc != USAGE_NETLOC
+        )
+
+    def _debug_response(self, method: str, r: requests.Response):
+        # Decoding the body is costly, only do it when debug logging is on.
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("HTTP %s <- %s status=%s headers=%s body=%s",
+                             method, r.url, r.status_code, r.headers, r.text)
 
     def _generate_pkce(self):
-        self.pkce_verifier = (
-            base64.urlsafe_b64encode(os.urandom(32)).decode("utf-8").rstrip("=")
-        )
+        verifier = base64.urlsafe_b64encode(os.urandom(32)).rstrip(b"=")
+        self.pkce_verifier = verifier.decode("ascii")
         self.pkce_challenge = (
-            base64.urlsafe_b64encode(
-                hashlib.sha256(self.pkce_verifier.encode()).digest()
-            )
-            .decode("utf-8")
-            .rstrip("=")
+            base64.urlsafe_b64encode(hashlib.sha256(verifier).digest())
+            .rstrip(b"=")
+            .decode("ascii")
         )
 
     def _authorize_b2c_1_tw_website_signin(self) -> tuple[str, str]:
-        url = "https://login.thameswater.co.uk/identity.thameswater.co.uk/b2c_1_tw_website_signin/oauth2/v2.0/authorize"
+        url = AUTHORIZE_URL
 
         params = {
             "client_id": self.client_id,
             "scope": "openid profile offline_access",
             "response_type": "code",
-            "redirect_uri": "https://www.thameswater.co.uk/login",
+            "redirect_uri": REDIRECT_URI,
             "response_mode": "fragment",
             "code_challenge": self.pkce_challenge,
             "code_challenge_method": "S256",
-            "nonce": str(uuid.uuid4()),
-            "state": str(uuid.uuid4()),
+            "nonce": secrets.token_urlsafe(16),
+            "state": secrets.token_urlsafe(16),
         }
 
         self.logger.debug("HTTP GET -> %s params=%s", url, params)
-        r = self.s.get(url, params=params)
-        self.logger.debug("HTTP GET <- %s status=%s headers=%s body=%s", 
-                         url, r.status_code, dict(r.headers), r.text)
+        r = self.s.get(url, params=params, timeout=REQUEST_TIMEOUT)
+        self._debug_response("GET", r)
         r.raise_for_status()
-        return dict(self.s.cookies)["x-ms-cpim-trans"], dict(self.s.cookies)[
-            "x-ms-cpim-csrf"
-        ]
+        trans_token = self.s.cookies.get("x-ms-cpim-trans", domain=LOGIN_DOMAIN)
+        csrf_token = self.s.cookies.get("x-ms-cpim-csrf", domain=LOGIN_DOMAIN)
+        if trans_token is None or csrf_token is None:
+            raise requests.HTTPError(
+                "Sign-in did not set the x-ms-cpim cookies", response=r
+            )
+        return trans_token, csrf_token
 
     def _self_asserted_b2c_1_tw_website_signin(
         self, email: str, password: str, trans_token: str, csrf_token: str
     ):
-        url = "https://login.thameswater.co.uk/identity.thameswater.co.uk/B2C_1_tw_website_signin/SelfAsserted"
+        url = SELF_ASSERTED_URL
 
         params = {
             "tx": f"StateProperties={trans_token}",
@@ -111,24 +224,16 @@ class ThamesWater:
 
         data = {"request_type": "RESPONSE", "email": email, "password": password}
 
-        headers = {
-            "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36",
-            "x-csrf-token": csrf_token,
-        }
+        headers = {"x-csrf-token": csrf_token}
 
         self.logger.debug("HTTP POST -> %s params=%s headers=%s data=%s", 
                          url, params, headers, data)
-        r = self.s.post(url, params=params, data=data, headers=headers)
-        self.logger.debug("HTTP POST <- %s status=%s headers=%s body=%s",
-                         url, r.status_code, dict(r.headers), r.text)
+        r = self.s.post(url, params=params, data=data, headers=headers, timeout=REQUEST_TIMEOUT)
+        self._debug_response("POST", r)
         r.raise_for_status()
 
     def _confirmed_b2c_1_tw_website_signin(self, trans_token: str, csrf_token: str):
-        url = "https://login.thameswater.co.uk/identity.thameswater.co.uk/B2C_1_tw_website_signin/api/CombinedSigninAndSignup/confirmed"
-
-        headers = {
-            "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36"
-        }
+        url = CONFIRMED_URL
 
         params = {
             "rememberMe": "false",
@@ -137,90 +242,62 @@ class ThamesWater:
             "p": "B2C_1_tw_website_signin",
         }
 
-        self.logger.debug("HTTP GET -> %s params=%s headers=%s", url, params, headers)
-        r = self.s.get(url, headers=headers, params=params)
-        self.logger.debug("HTTP GET <- %s status=%s headers=%s body=%s",
-                         url, r.status_code, dict(r.headers), r.text)
+        self.logger.debug("HTTP GET -> %s params=%s", url, params)
+        r = self.s.get(url, params=params, timeout=REQUEST_TIMEOUT)
+        self._debug_response("GET", r)
         r.raise_for_status()
 
-        confirmed_signup_structured_response = {
-            item.split("=")[0]: item.split("=")[1]
-            for item in r.url.split("#")[1].split("&")
-        }
-        return confirmed_signup_structured_response["code"]
+        confirmed_signup_structured_response = parse_qs(urlparse(r.url).fragment)
+        return confirmed_signup_structured_response["code"][0]
 
     def _get_oauth2_code_b2c_1_tw_website_signin(self, confirmation_code: str):
-        url = "https://login.thameswater.co.uk/identity.thameswater.co.uk/b2c_1_tw_website_signin/oauth2/v2.0/token"
+        url = TOKEN_URL
 
-        headers = {
-            "content-type": "application/x-www-form-urlencoded;charset=utf-8",
-            "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36",
-        }
+        headers = FORM_HEADERS
 
         data = {
             "client_id": self.client_id,
-            "redirect_uri": "https://www.thameswater.co.uk/login",
-            "scope": "openid offline_access profile",
-            "grant_type": "authorization_code",
-            "client_info": "1",
-            "x-client-SKU": "msal.js.browser",
-            "x-client-VER": "3.1.0",
-            "x-ms-lib-capability": "retry-after, h429",
-            "x-client-current-telemetry": "5|865,0,,,|,",
-            "x-client-last-telemetry": "5|0|||0,0",
+            **AUTHORIZATION_CODE_DATA,
             "code_verifier": self.pkce_verifier,
             "code": confirmation_code,
         }
 
         self.logger.debug("HTTP POST -> %s headers=%s data=%s", url, headers, data)
-        r = self.s.post(url, headers=headers, data=data)
-        self.logger.debug("HTTP POST <- %s status=%s headers=%s body=%s",
-                         url, r.status_code, dict(r.headers), r.text)
+        r = self.s.post(url, headers=headers, data=data, timeout=REQUEST_TIMEOUT)
+        self._debug_response("POST", r)
         r.raise_for_status()
         self.oauth_request_tokens = r.json()
 
     def _refresh_oauth2_token_b2c_1_tw_website_signin(self):
-        url = "https://login.thameswater.co.uk/identity.thameswater.co.uk/b2c_1_tw_website_signin/oauth2/v2.0/token"
+        url = TOKEN_URL
 
         data = {
             "client_id": self.client_id,
-            "scope": "openid profile offline_access",
-            "grant_type": "refresh_token",
-            "client_info": "1",
-            "x-client-SKU": "msal.js.browser",
-            "x-client-VER": "3.1.0",
-            "x-ms-lib-capability": "retry-after, h429",
-            "x-client-current-telemetry": "5|61,0,,,|@azure/msal-react,2.0.3",
-            "x-client-last-telemetry": "5|0|||0,0",
+            **REFRESH_TOKEN_DATA,
             "refresh_token": self.oauth_request_tokens["refresh_token"],
         }
 
-        headers = {"content-type": "application/x-www-form-urlencoded;charset=utf-8"}
+        headers = FORM_HEADERS
 
         self.logger.debug("HTTP GET -> %s headers=%s data=%s", url, headers, data)
-        r = self.s.get(url, headers=headers, data=data)
-        self.logger.debug("HTTP GET <- %s status=%s headers=%s body=%s",
-                         url, r.status_code, dict(r.headers), r.text)
+        r = self.s.get(url, headers=headers, data=data, timeout=REQUEST_TIMEOUT)
+        self._debug_response("GET", r)
         r.raise_for_status()
         self.oauth_response_tokens = r.json()
 
     def _login(self, state: str, id_token: str):
-        url = "https://myaccount.thameswater.co.uk/login"
+        url = LOGIN_URL
 
         data = {
             "state": state,
             "id_token": id_token,
         }
 
-        headers = {
-            "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36",
-            "content-type": "application/x-www-form-urlencoded",
-        }
+        headers = LOGIN_HEADERS
 
         self.logger.debug("HTTP POST -> %s headers=%s data=%s", url, headers, data)
-        r = self.s.post(url, data=data, headers=headers)
-        self.logger.debug("HTTP POST <- %s status=%s headers=%s body=%s",
-                         url, r.status_code, dict(r.headers), r.text)
+        r = self.s.post(url, data=data, headers=headers, timeout=REQUEST_TIMEOUT)
+        self._debug_response("POST", r)
         r.raise_for_status()
 
     def _authenticate(
@@ -239,34 +316,34 @@ class ThamesWater:
         self._get_oauth2_code_b2c_1_tw_website_signin(confirmation_code)
         self._refresh_oauth2_token_b2c_1_tw_website_signin()
 
-        headers = {
-            "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36",
-            "Referer": "https://myaccount.thameswater.co.uk/twservice/Account/SignIn?useremail=",
-        }
+        headers = MYACCOUNT_HEADERS
+
+        self.logger.debug("HTTP GET -> %s headers=%s", DASHBOARD_URL, headers)
+        r = self.s.get(DASHBOARD_URL, headers=headers, timeout=REQUEST_TIMEOUT)
+        self._debug_response("GET", r)
+
+        self.logger.debug("HTTP GET -> %s", self._dashboard_url)
+        r = self.s.get(self._dashboard_url, headers=headers, timeout=REQUEST_TIMEOUT)
+        self._debug_response("GET", r)
 
-        self.logger.debug("HTTP GET -> %s", "https://myaccount.thameswater.co.uk/mydashboard")
-        self.logger.debug("HTTP GET -> %s headers=%s", "https://myaccount.thameswater.co.uk/mydashboard", headers)
-        r = self.s.get("https://myaccount.thameswater.co.uk/mydashboard", headers=headers)
-        self.logger.debug("HTTP GET <- %s status=%s headers=%s body=%s",
-                         r.url, r.status_code, dict(r.headers), r.text)
-
-        dashboard_url = f"https://myaccount.thameswater.co.uk/mydashboard/my-meters-usage?contractAccountNumber={self.account_number}"
-        self.logger.debug("HTTP GET -> %s", dashboard_url)
-        r = self.s.get(dashboard_url, headers=headers)
-        self.logger.debug("HTTP GET <- %s status=%s headers=%s body=%s",
-                         r.url, r.status_code, dict(r.headers), r.text)
-
-        signin_url = "https://myaccount.thameswater.co.uk/twservice/Account/SignIn?useremail="
-        self.logger.debug("HTTP GET -> %s headers=%s", signin_url, headers)
-        r = self.s.get(signin_url, headers=headers)
-        self.logger.debug("HTTP GET <- %s status=%s headers=%s body=%s",
-                         r.url, r.status_code, dict(r.headers), r.text)
-        state = r.url.split("&state=")[1].split("&nonce=")[0].replace("%3d", "=")
-        id_token = r.text.split("id='id_token' value='")[1].split("'/>")[0]
+        self.logger.debug("HTTP GET -> %s headers=%s", SIGNIN_URL, headers)
+        r = self.s.get(SIGNIN_URL, headers=headers, timeout=REQUEST_TIMEOUT)
+        self._debug_response("GET", r)
+        states = parse_qs(urlparse(r.url).query).get("state")
+        if not states:
+            raise requests.HTTPError(
+                "SignIn did not redirect with a state", response=r
+            )
+        state = states[0]
+        match = ID_TOKEN_RE.search(r.content)
+        if match is None:
+            raise requests.HTTPError(
+                "SignIn page did not contain an id_token", response=r
+            )
+        id_token = match.group(1).decode("ascii")
         self.logger.debug("HTTP GET -> %s", r.url)
-        r = self.s.get(r.url, headers=headers)
-        self.logger.debug("HTTP GET <- %s status=%s headers=%s body=%s",
-                         r.url, r.status_code, dict(r.headers), r.text)
+        r = self.s.get(r.url, headers=headers, timeout=REQUEST_TIMEOUT)
+        self._debug_response("GET", r)
         self._login(state, id_token)
         self.s.cookies.set(name="b2cAuthenticated", value="true")
 
@@ -277,7 +354,7 @@ class ThamesWater:
         end: datetime.datetime,
         granularity: Literal["H", "D", "M"] = "H",
     ) -> MeterUsage:
-        url = "https://myaccount.thameswater.co.uk/ajax/waterMeter/getSmartWaterMeterConsumptions"
+        url = USAGE_URL
 
         params = {
             "meter": meter,
@@ -292,18 +369,34 @@ class ThamesWater:
             "isForC4C": "false",
         }
 
-        headers = {
-            "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36",
-            "Referer": "https://myaccount.thameswater.co.uk/mydashboard/my-meters-usage",
-            "X-Requested-With": "XMLHttpRequest",
-        }
+        headers = USAGE_HEADERS
 
+        self.ensure_authenticated()
+        generation = self._auth_generation
         self.logger.debug("HTTP GET -> %s params=%s headers=%s", url, params, headers)
-        r = self.s.get(url, params=params, headers=headers)
-        self.logger.debug("HTTP GET <- %s status=%s headers=%s body=%s",
-                         url, r.status_code, dict(r.headers), r.text)
+        r = self.s.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+        self.logger.debug("HTTP GET <- %s status=%s headers=%s bytes=%d",
+                         url, r.status_code, r.headers, len(r.content))
+        if self._session_rejected(r):
+            # The session cookies have expired (rejected, or redirected off
+            # myaccount to the login flow), log in again and retry once.
+            self.logger.debug("Session rejected, re-authenticating")
+            self._authenticate_once(generation)
+            r = self.s.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+            self.logger.debug("HTTP GET <- %s status=%s headers=%s bytes=%d",
+                             url, r.status_code, r.headers, len(r.content))
+            if self._session_rejected(r):
+                raise SessionExpiredError(
+                    "Usage request rejected after re-authenticating", response=r
+                )
         r.raise_for_status()
 
-        data = r.json()
-        data["Lines"] = [Line(**line) for line in data["Lines"]]
-        return MeterUsage(**data)
+        try:
+            data = orjson.loads(r.content)
+        except orjson.JSONDecodeError as err:
+            # An HTML page instead of JSON means the session is not valid.
+            raise SessionExpiredError(
+                "Usage response is not JSON", response=r
+            ) from err
+        lines = [Line(*LINE_FIELDS(line)) for line in data.pop("Lines")]
+        return MeterUsage(**data, Lines=lines)